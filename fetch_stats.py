@@ -1,164 +1,374 @@
-import os
-import json
-import gspread
-import pandas as pd
-import requests
-from oauth2client.service_account import ServiceAccountCredentials
-from datetime import datetime, timedelta
-
-# --- CONFIGURATION ---
-# The names of your Google Sheet and the specific worksheet
-GOOGLE_SHEET_NAME = 'NFL Player Stats'
-WORKSHEET_NAME = 'Sheet1'
-
-# Your Google credentials JSON content stored as a secret.
-GOOGLE_CREDENTIALS_JSON = os.environ.get('GOOGLE_CREDENTIALS_JSON')
-
-# --- DYNAMIC WEEK AND YEAR ---
-def get_current_nfl_week():
-    """Calculates the current NFL week based on the current date."""
-    now = datetime.utcnow()
-    year = now.year
-    
-    # NFL season typically starts on the Thursday of the first full week of September.
-    # We'll set our "week 1" cutoff as the first Tuesday of September.
-    first_tuesday_sept = None
-    for day in range(1, 8):
-        d = datetime(year, 9, day)
-        if d.weekday() == 1: # Tuesday (0=Monday, 1=Tuesday, ...)
-            first_tuesday_sept = d
-            break
-    
-    # If it's before the season start, we are in the offseason.
-    # The script will fetch the last week of the previous season.
-    if now < first_tuesday_sept:
-        return str(year - 1), '18'
-
-    # Calculate how many full weeks have passed since the season started.
-    week = ((now - first_tuesday_sept).days // 7) + 1
-    
-    # Return the current year and the calculated week, capped at 18 for the regular season.
-    return str(year), str(week if week <= 18 else 18)
-
-YEAR, WEEK = get_current_nfl_week()
-print(f"Detected current season: {YEAR}, Week: {WEEK}")
-
-
-# --- 1. FETCH AND PROCESS DATA FROM SLEEPER API ---
-def fetch_and_process_data(year, week):
-    """Fetches and processes player stats from Sleeper's free API."""
-    base_url = "https://api.sleeper.app/v1"
-    
-    print("Fetching master player list from Sleeper...")
-    players_response = requests.get(f"{base_url}/players/nfl")
-    if players_response.status_code != 200:
-        print("Error fetching player list.")
-        return None
-    players_data = players_response.json()
-    
-    player_map = {}
-    for player_id, player_info in players_data.items():
-        player_map[player_id] = {
-            'name': f"{player_info.get('first_name', '')} {player_info.get('last_name', '')}".strip(),
-            'team': player_info.get('team', 'N/A'),
-            'position': player_info.get('position', 'N/A')
-        }
-
-    print(f"Fetching weekly stats for Week {week}, Season {year}...")
-    stats_response = requests.get(f"{base_url}/stats/nfl/regular/{year}/{week}")
-    if stats_response.status_code != 200:
-        print(f"Error fetching weekly stats. Status: {stats_response.status_code}")
-        return None
-    weekly_stats_data = stats_response.json()
-
-    all_player_stats = []
-    for player_id, stats in weekly_stats_data.items():
-        player_info = player_map.get(player_id)
-        if not player_info:
-            continue
-
-        record = {
-            'Week': week,
-            'PlayerName': player_info['name'],
-            'Team': player_info['team'],
-            'Position': player_info['position'],
-            'Receptions': stats.get('rec', 0),
-            'ReceivingYards': stats.get('rec_yd', 0),
-            'ReceivingTDs': stats.get('rec_td', 0),
-            'RushingYards': stats.get('rush_yd', 0),
-            'RushingTDs': stats.get('rush_td', 0),
-            'PassingAttempts': stats.get('pass_att', 0),
-            'Targets': stats.get('rec_tgt', 0),
-            'SnapCounts': stats.get('off_snp', 0)
-        }
-        all_player_stats.append(record)
-        
-    print(f"Processed {len(all_player_stats)} total player records.")
-    return all_player_stats
-
-# --- 2. WRITE DATA TO GOOGLE SHEETS ---
-def update_google_sheet(data_df, week_to_update):
-    """Writes the data to the Google Sheet, deleting old data for the week first."""
-    print("Connecting to Google Sheets...")
-    
-    try:
-        creds_dict = json.loads(GOOGLE_CREDENTIALS_JSON)
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, 
-            ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive'])
-    except:
-        print("Could not load Google credentials from environment variable.")
-        print("Falling back to local 'your-credentials-file.json' for testing.")
-        try:
-            creds = ServiceAccountCredentials.from_json_keyfile_name('your-credentials-file.json', 
-                ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive'])
-        except FileNotFoundError:
-            print("Local credentials file not found. Please set up the GitHub Secret or local file.")
-            return
-
-    client = gspread.authorize(creds)
-    sheet = client.open(GOOGLE_SHEET_NAME).worksheet(WORKSHEET_NAME)
-    
-    # --- Delete Old Data for the Week ---
-    print(f"Checking for and deleting any existing data for Week {week_to_update}...")
-    cell_list = sheet.findall(week_to_update, in_column=1)
-    if cell_list:
-        rows_to_delete = [cell.row for cell in cell_list]
-        # Reverse sort to delete from the bottom up, avoiding index shifts
-        for row_index in sorted(rows_to_delete, reverse=True):
-            sheet.delete_rows(row_index)
-        print(f"Deleted {len(rows_to_delete)} old rows for Week {week_to_update}.")
-
-    # --- Append New Data ---
-    if data_df.empty:
-        print("No new data to write to the sheet.")
-        return
-
-    print(f"Writing {len(data_df)} new rows for Week {week_to_update}...")
-    sheet.append_rows(data_df.values.tolist(), value_input_option='USER_ENTERED')
-    
-    print("Google Sheet has been updated successfully!")
-
-# --- MAIN EXECUTION ---
-if __name__ == "__main__":
-    processed_records = fetch_and_process_data(YEAR, WEEK)
-    
-    if processed_records:
-        df = pd.DataFrame(processed_records)
-        
-        if not df.empty:
-            # Filter out players with zero snaps to keep the sheet clean
-            df = df[df['SnapCounts'] > 0]
-
-            df = df[[
-                'Week', 'PlayerName', 'Team', 'Position', 'Receptions', 
-                'ReceivingYards', 'ReceivingTDs', 'RushingYards', 'RushingTDs',
-                'PassingAttempts', 'Targets', 'SnapCounts'
-            ]]
-            
-            print("\n--- Sample of Processed Data ---")
-            print(df.head())
-            update_google_sheet(df, WEEK)
-        else:
-            print("Processed data is empty, nothing to update.")
-
-    print("\nScript finished.")
+import functools
+import hashlib
+import logging
+import os
+import json
+import gspread
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from google.oauth2.service_account import Credentials
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# orjson decodes the ~5MB player blob several times faster than stdlib
+# json; fall back to stdlib when it isn't installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+# The spreadsheet ID (from the sheet's URL) stored as a secret, and the
+# specific worksheet. Opening by ID hits spreadsheets.get directly, with
+# no Drive search by title and no Drive OAuth scope.
+SHEET_ID = os.environ.get('SHEET_ID')
+WORKSHEET_NAME = 'Sheet1'
+
+# Tiny bookkeeping worksheet: row N holds [start_row, end_row, hash] of
+# week N's block on the data sheet, so finding a week's rows is one
+# small read instead of downloading and scanning all of column A. The
+# hash of the raw upstream payload lets an unchanged week skip the
+# clear+write entirely.
+INDEX_WORKSHEET_NAME = 'WeekIndex'
+
+# Your Google credentials JSON content stored as a secret.
+GOOGLE_CREDENTIALS_JSON = os.environ.get('GOOGLE_CREDENTIALS_JSON')
+GOOGLE_SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+# Shared HTTP session for the Sleeper API so every call reuses the same
+# TCP+TLS connection instead of handshaking from scratch. Advertise
+# brotli as well as gzip: the ~5MB player blob is highly compressible
+# and requests decodes br transparently when the brotli package is
+# installed.
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+session.headers.update({"Accept-Encoding": "gzip, br"})
+
+# Local cache for the ~5MB master player list, which barely changes
+# week-to-week. Restored between Actions runs via actions/cache.
+PLAYERS_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'sleeper')
+PLAYERS_CACHE_FILE = os.path.join(PLAYERS_CACHE_DIR, 'players.json')
+PLAYERS_ETAG_FILE = os.path.join(PLAYERS_CACHE_DIR, 'players.etag')
+
+# --- DYNAMIC WEEK AND YEAR ---
+def get_current_nfl_week():
+    """Calculates the current NFL week based on the current date."""
+    now = datetime.utcnow()
+    year = now.year
+    
+    # NFL season typically starts on the Thursday of the first full week of September.
+    # We'll set our "week 1" cutoff as the first Tuesday of September,
+    # found directly with weekday arithmetic (0=Monday, 1=Tuesday, ...).
+    sept_first = datetime(year, 9, 1)
+    first_tuesday_sept = sept_first + timedelta(days=(1 - sept_first.weekday()) % 7)
+
+    # If it's before the season start, we are in the offseason.
+    # The script will fetch the last week of the previous season.
+    if now < first_tuesday_sept:
+        return str(year - 1), '18'
+
+    # Calculate how many full weeks have passed since the season started.
+    week = ((now - first_tuesday_sept).days // 7) + 1
+    
+    # Return the current year and the calculated week, capped at 18 for the regular season.
+    return str(year), str(week if week <= 18 else 18)
+
+
+# Sleeper stat keys mapped to the sheet's column names, in sheet order.
+STAT_RENAME = {
+    'rec': 'Receptions',
+    'rec_yd': 'ReceivingYards',
+    'rec_td': 'ReceivingTDs',
+    'rush_yd': 'RushingYards',
+    'rush_td': 'RushingTDs',
+    'pass_att': 'PassingAttempts',
+    'rec_tgt': 'Targets',
+    'off_snp': 'SnapCounts',
+}
+
+
+def load_json(raw):
+    """Decodes JSON bytes with orjson when available, stdlib json otherwise."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+# --- 1. FETCH AND PROCESS DATA FROM SLEEPER API ---
+def fetch_players_data(base_url):
+    """Fetches the master player list, reusing the local cache when Sleeper says it's unchanged."""
+    headers = {}
+    if os.path.exists(PLAYERS_CACHE_FILE) and os.path.exists(PLAYERS_ETAG_FILE):
+        with open(PLAYERS_ETAG_FILE) as f:
+            cached_etag = f.read().strip()
+        if cached_etag:
+            headers['If-None-Match'] = cached_etag
+
+    response = session.get(f"{base_url}/players/nfl", headers=headers)
+
+    if response.status_code == 304:
+        logger.info("Player list unchanged since last run, using cached copy.")
+        with open(PLAYERS_CACHE_FILE, 'rb') as f:
+            return load_json(f.read())
+    if response.status_code != 200:
+        return None
+
+    # Confirm the server actually honored the compression we asked for.
+    encoding = response.headers.get('Content-Encoding', 'identity')
+    logger.debug("Player list downloaded (%s encoded).", encoding)
+
+    etag = response.headers.get('ETag')
+    if etag:
+        os.makedirs(PLAYERS_CACHE_DIR, exist_ok=True)
+        with open(PLAYERS_CACHE_FILE, 'wb') as f:
+            f.write(response.content)
+        with open(PLAYERS_ETAG_FILE, 'w') as f:
+            f.write(etag)
+
+    return load_json(response.content)
+
+
+def fetch_and_process_data(year, weeks):
+    """Fetches and processes player stats for one or more weeks from Sleeper's free API."""
+    base_url = "https://api.sleeper.app/v1"
+
+    # Fetch the small per-week stats first, fanned out over the shared
+    # session so total wait is bounded by the slowest response; the pool
+    # size caps concurrent connections for an 18-week backfill.
+    logger.info("Fetching stats for week(s) %s from Sleeper...", ', '.join(weeks))
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        stats_futures = {
+            week: executor.submit(session.get, f"{base_url}/stats/nfl/regular/{year}/{week}")
+            for week in weeks
+        }
+        stats_responses = {week: future.result() for week, future in stats_futures.items()}
+
+    week_payloads = {}
+    for week in weeks:
+        stats_response = stats_responses[week]
+        if stats_response.status_code != 200:
+            logger.error("Error fetching Week %s stats. Status: %s", week, stats_response.status_code)
+            continue
+        weekly_stats_data = load_json(stats_response.content)
+        if not weekly_stats_data:
+            logger.info("No stats published for Week %s yet.", week)
+            continue
+        week_payloads[week] = (stats_response.content, weekly_stats_data)
+
+    # Off-season or early-week runs often find nothing; bail before the
+    # ~5MB player list download, which would be pure waste.
+    if not week_payloads:
+        logger.info("No weekly stats available; skipping the player list download.")
+        return None, {}
+
+    logger.info("Fetching master player list from Sleeper...")
+    players_data = fetch_players_data(base_url)
+    if players_data is None:
+        logger.error("Error fetching player list.")
+        return None, {}
+
+    # Build the player lookup as one vectorized DataFrame instead of
+    # looping over ~10k players in Python.
+    players_df = pd.DataFrame.from_dict(players_data, orient='index')
+    players_df = players_df.reindex(columns=['first_name', 'last_name', 'team', 'position'])
+    players_df['PlayerName'] = (
+        players_df['first_name'].fillna('') + ' ' + players_df['last_name'].fillna('')
+    ).str.strip()
+    players_df = players_df.rename(columns={'team': 'Team', 'position': 'Position'})
+    players_df = players_df[['PlayerName', 'Team', 'Position']].fillna('N/A')
+
+    week_frames = []
+    week_hashes = {}
+    for week, (raw_payload, weekly_stats_data) in week_payloads.items():
+        # Fingerprint the raw payload so the sheet write can be skipped
+        # when Sleeper hasn't published anything new for the week.
+        week_hashes[week] = hashlib.blake2b(raw_payload, digest_size=16).hexdigest()
+
+        # Filter out players with zero snaps to keep the sheet clean.
+        # Done on the raw dict so dropped rows are never allocated into
+        # pandas, let alone renamed or joined.
+        active_stats = {player_id: stats for player_id, stats in weekly_stats_data.items()
+                        if stats.get('off_snp', 0) > 0}
+
+        stats_df = pd.DataFrame.from_dict(active_stats, orient='index')
+        stats_df = stats_df.reindex(columns=list(STAT_RENAME), fill_value=0).fillna(0)
+        stats_df = stats_df.rename(columns=STAT_RENAME)
+
+        # Inner join on player_id drops stat rows with no matching player,
+        # same as the old player_map.get() check.
+        week_df = stats_df.join(players_df, how='inner')
+        week_df.insert(0, 'Week', int(week))
+        week_frames.append(week_df)
+
+    if not week_frames:
+        return None, {}
+    df = pd.concat(week_frames)
+
+    # Plain ints serialize smaller than floats and let the Sheets write
+    # use RAW input without locale-aware re-parsing on the backend.
+    # int32 halves the stat buffers vs the inferred int64, and category
+    # dtype stores each team/position string once instead of per row.
+    stat_columns = list(STAT_RENAME.values())
+    df = df.astype({col: 'int32' for col in stat_columns}
+                   | {'Week': 'int32', 'Team': 'category', 'Position': 'category'})
+
+    logger.info("Processed %d total player records.", len(df))
+    return df, week_hashes
+
+# --- 2. WRITE DATA TO GOOGLE SHEETS ---
+@functools.lru_cache(maxsize=1)
+def get_gspread_client():
+    """Authorizes gspread once; repeat calls reuse the client and its token."""
+    try:
+        creds_dict = load_json(GOOGLE_CREDENTIALS_JSON)
+        creds = Credentials.from_service_account_info(creds_dict, scopes=GOOGLE_SCOPES)
+    # TypeError when the env var is unset, ValueError (JSONDecodeError)
+    # when it holds malformed JSON. Anything else should surface.
+    except (TypeError, ValueError):
+        logger.warning("Could not load Google credentials from environment variable.")
+        logger.warning("Falling back to local 'your-credentials-file.json' for testing.")
+        try:
+            creds = Credentials.from_service_account_file('your-credentials-file.json',
+                scopes=GOOGLE_SCOPES)
+        except FileNotFoundError:
+            logger.error("Local credentials file not found. Please set up the GitHub Secret or local file.")
+            return None
+
+    return gspread.authorize(creds)
+
+
+def update_google_sheet(data_df, week_to_update, content_hash=None):
+    """Writes the data to the Google Sheet, deleting old data for the week first."""
+    logger.info("Connecting to Google Sheets...")
+
+    if not SHEET_ID:
+        logger.error("SHEET_ID is not set. Add the spreadsheet ID from the sheet URL as a secret.")
+        return
+
+    client = get_gspread_client()
+    if client is None:
+        return
+    spreadsheet = client.open_by_key(SHEET_ID)
+    sheet = spreadsheet.worksheet(WORKSHEET_NAME)
+
+    # --- Clear Old Data for the Week ---
+    logger.info("Checking for and clearing any existing data for Week %s...", week_to_update)
+    try:
+        index_sheet = spreadsheet.worksheet(INDEX_WORKSHEET_NAME)
+        # Widen index sheets created before the hash column existed;
+        # values.update can't write past the grid edge.
+        if index_sheet.col_count < 3:
+            index_sheet.add_cols(3 - index_sheet.col_count)
+    except gspread.WorksheetNotFound:
+        index_sheet = spreadsheet.add_worksheet(INDEX_WORKSHEET_NAME, rows=20, cols=3)
+    index_rows = index_sheet.get_values('A1:C18')
+    week_row = int(week_to_update)
+    entry = index_rows[week_row - 1] if len(index_rows) >= week_row else []
+
+    # If the upstream payload hash matches what we recorded last time,
+    # the sheet already holds this exact data; skip the clear and write.
+    if content_hash and len(entry) >= 3 and entry[2] == content_hash and not data_df.empty:
+        logger.info("Week %s data unchanged upstream; sheet left as is.", week_to_update)
+        return
+
+    if len(entry) >= 2 and entry[1]:
+        lo, hi = int(entry[0]), int(entry[1])
+        sheet.batch_clear([f"A{lo}:L{hi}"])
+        logger.info("Cleared rows %d-%d of old Week %s data.", lo, hi, week_to_update)
+        # First free row is one past the furthest block held by the other
+        # weeks, straight from the index with no column scan. Never start
+        # above this week's old block, so untracked rows ahead of the
+        # data (e.g. a header) are left alone.
+        last_data_row = max(
+            (int(row[1]) for i, row in enumerate(index_rows)
+             if i + 1 != week_row and len(row) >= 2 and row[1]),
+            default=0,
+        )
+        last_data_row = max(last_data_row, lo - 1)
+    else:
+        # No entry for this week - the sheet predates the index, or this
+        # week was last written before the index existed. Scan column A
+        # once; the entry recorded below makes the next run index-driven.
+        week_column = sheet.col_values(1)
+        rows_to_clear = [i + 1 for i, value in enumerate(week_column) if value == week_to_update]
+        if rows_to_clear:
+            # Group consecutive row numbers into ranges so the whole wipe
+            # is one batch_clear call instead of a round-trip per row.
+            ranges = []
+            start = prev = rows_to_clear[0]
+            for row in rows_to_clear[1:]:
+                if row == prev + 1:
+                    prev = row
+                else:
+                    ranges.append((start, prev))
+                    start = prev = row
+            ranges.append((start, prev))
+            sheet.batch_clear([f"A{lo}:L{hi}" for lo, hi in ranges])
+            logger.info("Cleared %d old rows for Week %s.", len(rows_to_clear), week_to_update)
+        cleared = set(rows_to_clear)
+        last_data_row = 0
+        for i, value in enumerate(week_column):
+            if value and (i + 1) not in cleared:
+                last_data_row = i + 1
+
+    # --- Write New Data ---
+    if data_df.empty:
+        # The week's block is gone, so drop its index entry too.
+        index_sheet.batch_clear([f"A{week_row}:C{week_row}"])
+        logger.info("No new data to write to the sheet.")
+        return
+
+    start = last_data_row + 1
+    rows = data_df.to_numpy().tolist()
+    end = start + len(rows) - 1
+    logger.info("Writing %d new rows for Week %s...", len(rows), week_to_update)
+    # Unlike values.append, values.update doesn't grow the grid, so make
+    # room first when the block runs past the current last row.
+    if end > sheet.row_count:
+        sheet.add_rows(end - sheet.row_count)
+    # No cell in this schema holds a formula, so RAW skips the backend's
+    # per-cell type inference that USER_ENTERED forces.
+    sheet.update(values=rows, range_name=f"A{start}:L{end}", value_input_option='RAW')
+
+    # Record the new block and payload hash so the next run reads them
+    # from the index.
+    index_sheet.update(values=[[start, end, content_hash or '']],
+        range_name=f"A{week_row}:C{week_row}", value_input_option='RAW')
+
+    logger.info("Google Sheet has been updated successfully!")
+
+# --- MAIN EXECUTION ---
+if __name__ == "__main__":
+    # INFO keeps the run log readable on Actions; LOGLEVEL=DEBUG adds
+    # diagnostics like the processed-data sample.
+    logging.basicConfig(level=os.environ.get('LOGLEVEL', 'INFO'), format='%(message)s')
+
+    YEAR, WEEK = get_current_nfl_week()
+    logger.info("Detected current season: %s, Week: %s", YEAR, WEEK)
+
+    # Optional comma-separated list of weeks (e.g. "1,2,3") to backfill
+    # in one run; defaults to just the current week.
+    weeks = os.environ.get('BACKFILL_WEEKS', WEEK).split(',')
+
+    df, week_hashes = fetch_and_process_data(YEAR, weeks)
+
+    if df is not None:
+        if not df.empty:
+            df = df[[
+                'Week', 'PlayerName', 'Team', 'Position', 'Receptions',
+                'ReceivingYards', 'ReceivingTDs', 'RushingYards', 'RushingTDs',
+                'PassingAttempts', 'Targets', 'SnapCounts'
+            ]]
+
+            logger.debug("Sample of processed data:\n%s", df.head())
+            # Only weeks that actually fetched get written; touching a
+            # failed week's slice (always empty) would clear its rows.
+            for week in week_hashes:
+                update_google_sheet(df[df['Week'] == int(week)], week, week_hashes[week])
+        else:
+            logger.info("Processed data is empty, nothing to update.")
+
+    logger.info("Script finished.")